@@ -1,13 +1,49 @@
 import os
+import re
+import shutil
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse, parse_qs, urlencode, urlunparse
+from requests.adapters import HTTPAdapter
+import urllib3
+from urllib3.util import Retry
+from lxml import etree
+from urllib.parse import urljoin, urlparse
 import argparse
 import sys
 import concurrent.futures
 from tqdm import tqdm
 import logging
-from tenacity import retry, stop_after_attempt, wait_fixed
+import atexit
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# Splits an href into its path (everything before '?' or '#') and raw query string
+_URL_RE = re.compile(r'^([^?#]+)(?:\?([^#]*))?')
+
+# A '.part' file untouched for this many seconds is treated as left behind by
+# an interrupted run rather than still being written
+_STALE_PART_AGE = 10 * 60
+
+def positive_int(value):
+    """
+    Argparse type for options that must be a whole number of at least 1.
+
+    Args:
+        value (str): The raw command-line value.
+
+    Returns:
+        int: The parsed value.
+
+    Raises:
+        argparse.ArgumentTypeError: If the value is not an integer >= 1.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
 
 def parse_arguments():
     """
@@ -56,6 +92,10 @@ def parse_arguments():
                         help='Remove the watermark query parameter from image URLs.')
     parser.add_argument('-p', '--parallel', action='store_true',
                         help='Enable parallel downloads using multithreading.')
+    parser.add_argument('-j', '--jobs', type=positive_int, default=32,
+                        help='Number of concurrent downloads when --parallel is used. '
+                             'Downloads are network-bound, so the server rather than '
+                             'the local CPU is the limit. Default is 32.')
     parser.add_argument('-l', '--log', action='store_true',
                         help='Enable logging to a file "image_downloader.log".')
     return parser.parse_args()
@@ -73,158 +113,263 @@ def get_page_url(base_url, order_id):
     """
     return f"{base_url}/backend/general/photos/seller?orderid={order_id}"
 
-def get_html_content(url, headers):
+def create_session(headers, pool_maxsize=32):
     """
-    Fetches HTML content from the specified URL.
+    Creates a shared HTTP session so that all requests to the portal reuse
+    pooled keep-alive connections instead of a new TCP+TLS handshake each.
+    Failed connections and transient server errors (429, 5xx) are retried up
+    to 2 times with exponential backoff, i.e. at most 3 attempts per request.
 
     Args:
-        url (str): The URL to fetch HTML content from.
-        headers (dict): HTTP headers to include in the request.
+        headers (dict): HTTP headers to include in every request.
+        pool_maxsize (int, optional): Maximum number of pooled connections.
+            Should cover every download worker plus the page fetch. Defaults to 32.
 
     Returns:
-        str: The fetched HTML content as a string. Returns an empty string on failure.
+        requests.Session: Configured session object.
+    """
+    session = requests.Session()
+    session.headers.update(headers)
+    # Retry transient failures inside the connection pool, with exponential backoff
+    retries = Retry(
+        total=2,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET'])
+    )
+    # All images live on the same host, so a single pool with room for every
+    # worker is enough
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_maxsize,
+        pool_block=True,
+        max_retries=retries
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def read_hrefs(parser):
     """
+    Yields the href of every <a> tag the parser has finished since the last
+    call, discarding each tag and everything before it from the tree.
+
+    Args:
+        parser (lxml.etree.HTMLPullParser): Parser reporting <a> end events.
+
+    Yields:
+        str: The tag's href attribute, or None if it has none.
+    """
+    for _, element in parser.read_events():
+        href = element.get('href')
+        # Processed tags are never looked at again, so keep the tree from
+        # growing with the page
+        element.clear()
+        parent = element.getparent()
+        if parent is not None:
+            while element.getprevious() is not None:
+                del parent[0]
+        yield href
+
+def iter_hrefs(chunks, encoding=None):
+    """
+    Feeds HTML chunks to an incremental parser and yields the href of every
+    <a> tag as soon as the tag has been parsed.
+
+    Args:
+        chunks (iterable): Iterable of raw HTML byte chunks.
+        encoding (str, optional): Character encoding of the page. Defaults to
+            None, which lets the parser detect it from the document.
+
+    Yields:
+        str: The tag's href attribute, or None if it has none.
+    """
+    # Only <a> end events are reported, so the rest of the page is never visited
+    parser = etree.HTMLPullParser(events=('end',), tag='a', encoding=encoding)
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from read_hrefs(parser)
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        return response.text
-    except requests.RequestException as e:
-        print(f"Error fetching HTML from URL: {e}")
-        return ""
+        parser.close()
+    except etree.XMLSyntaxError:
+        # Raised for an empty page; there are simply no links to report
+        return
+    yield from read_hrefs(parser)
 
-def extract_image_urls(html, base_url, extensions, remove_params):
+def iter_image_urls(session, page_url, base_url, ext_tuple, remove_set):
     """
-    Parses HTML to extract all unique image URLs with specified extensions,
-    removing specified query parameters.
+    Streams the HTML page and yields all unique image URLs with specified
+    extensions, removing specified query parameters. URLs are yielded as soon
+    as their <a> tag arrives, so downloads can start before the whole page
+    has been received. URLs that only differ in their query string (e.g.
+    watermarked or scaled variants) point at the same file and are collapsed
+    into the first one found.
 
     Args:
-        html (str): The HTML content to parse.
+        session (requests.Session): Session used to fetch the page.
+        page_url (str): The URL of the page listing the images.
         base_url (str): The base URL to construct full image URLs.
-        extensions (list): List of file extensions to filter images.
-        remove_params (dict): Dictionary indicating which parameters to remove.
-            Keys can include 'raw_image', 'no_watermark', and 'additional_params'.
+        ext_tuple (tuple): Lowercase file extensions to filter images.
+        remove_set (frozenset): Names of query parameters to remove.
 
-    Returns:
-        list: A list of cleaned, full image URLs.
+    Yields:
+        str: A cleaned, full image URL.
+
+    Raises:
+        requests.RequestException: If fetching the page fails, including
+            partway through the stream.
     """
-    soup = BeautifulSoup(html, 'html.parser')
-    image_urls = set()
-
-    # Normalize extensions to lowercase for case-insensitive matching
-    extensions = [ext.lower() for ext in extensions]
-
-    # Iterate over all <a> tags with an href attribute
-    for a_tag in soup.find_all('a', href=True):
-        href = a_tag['href']
-        # Check if the href contains '/orderfiles/'
-        if '/orderfiles/' in href:
-            parsed_url = urlparse(href)
+    # Absolute image paths that have already been yielded
+    seen_paths = set()
+
+    # Bind the hot-loop lookup to a local once
+    match_url = _URL_RE.match
+
+    # requests already advertises every compression it can decode (brotli only
+    # if installed), so the page arrives compressed whenever the server allows
+    with session.get(page_url, stream=True) as response:
+        response.raise_for_status()
+        # Decompress chunk by chunk straight into the parser, without building
+        # the page as bytes or str first; iter_content also wraps mid-stream
+        # urllib3 errors in requests exceptions
+        chunks = response.iter_content(32768)
+        # Only force the charset the Content-Type header actually declares;
+        # otherwise let lxml read it from the page's <meta> tag (requests'
+        # ISO-8859-1 default for text/* would override it)
+        content_type = response.headers.get('Content-Type', '')
+        encoding = response.encoding if 'charset' in content_type.lower() else None
+        for href in iter_hrefs(chunks, encoding=encoding):
+            # Check if the href contains '/orderfiles/'
+            if not href or '/orderfiles/' not in href:
+                continue
+            match = match_url(href)
+            if not match:
+                continue
+            path, query = match.group(1), match.group(2) or ''
             # Check if the path ends with one of the specified extensions
-            if any(parsed_url.path.lower().endswith(ext) for ext in extensions):
-                # Parse existing query parameters into a dictionary
-                query_dict = parse_qs(parsed_url.query)
-
-                # Remove 'width' and 'height' if raw_image flag is set
-                if remove_params.get('raw_image'):
-                    query_dict.pop('width', None)
-                    query_dict.pop('height', None)
-
-                # Remove 'watermark' if no_watermark flag is set
-                if remove_params.get('no_watermark'):
-                    query_dict.pop('watermark', None)
-
-                # Remove any additional parameters specified via --remove_params
-                for param in remove_params.get('additional_params', []):
-                    query_dict.pop(param, None)
-
-                # Reconstruct query string
-                new_query = urlencode(query_dict, doseq=True)
-
-                # Reconstruct the URL without the specified query parameters
-                clean_url = urlunparse((
-                    parsed_url.scheme,
-                    parsed_url.netloc,
-                    parsed_url.path,
-                    parsed_url.params,
-                    new_query,
-                    parsed_url.fragment
-                ))
-
-                # Ensure the URL is absolute by joining with the base URL
-                full_url = urljoin(base_url, clean_url)
-                image_urls.add(full_url)
-
-    return list(image_urls)
-
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-def download_image(url, output_dir, headers, logger=None):
+            if not path.lower().endswith(ext_tuple):
+                continue
+
+            # Ensure the path is absolute by joining with the base URL
+            if not path.startswith(('http://', 'https://')):
+                path = urljoin(base_url, path)
+            # Skip variants of an image that has already been collected
+            if path in seen_paths:
+                continue
+            seen_paths.add(path)
+
+            # Keep the original key=value pairs for every parameter not being removed
+            if query and remove_set:
+                query = '&'.join(
+                    kv for kv in query.split('&')
+                    if kv and kv.split('=', 1)[0] not in remove_set
+                )
+            yield f"{path}?{query}" if query else path
+
+def download_image(url, output_dir, session, logger=None):
     """
     Downloads an image from the specified URL to the output directory.
-    Retries up to 3 times with a 2-second wait between attempts on failure.
+    Retries are handled by the session's connection pool (see create_session).
+
+    The image is written to '<filename>.part' and renamed into place once
+    complete, so an interrupted download never leaves a truncated image
+    behind. The '.part' file is created exclusively, so if something else is
+    already writing it (e.g. another run on the same directory) this call
+    returns without doing anything. main() only clears '.part' files that
+    have not been modified for _STALE_PART_AGE seconds.
 
     Args:
         url (str): The image URL to download.
         output_dir (str): The directory to save the downloaded image.
-        headers (dict): HTTP headers to include in the request.
-        logger (logging.Logger, optional): Logger object for logging. Defaults to None.
+        session (requests.Session): Session used to perform the request.
+        logger (logging.Logger, optional): Logger object for logging. Defaults to
+            the 'ImageDownloader' logger, which only reports errors (to stderr)
+            unless logging has been set up.
 
     Raises:
         Exception: If the download fails after retries.
     """
+    # Never print from workers: it contends with the progress bar for stdout
+    logger = logger or logging.getLogger('ImageDownloader')
     try:
         # Extract the image filename from the URL path
         filename = os.path.basename(urlparse(url).path)
         local_filename = os.path.join(output_dir, filename)
-
-        # Check if the file already exists to avoid redundant downloads
-        if os.path.exists(local_filename):
-            if logger:
-                logger.info(f"Already exists: {local_filename}")
-            else:
-                print(f"Already exists: {local_filename}")
+        part_filename = local_filename + '.part'
+
+        # Claim the filename atomically so parallel workers never write the same file
+        try:
+            # O_BINARY stops Windows from translating newlines in the image data
+            flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+            fd = os.open(part_filename, flags, 0o644)
+        except FileExistsError:
+            logger.info(f"Already downloading: {local_filename}")
             return
 
-        # Stream the download to handle large files efficiently
-        with requests.get(url, stream=True, headers=headers) as r:
-            r.raise_for_status()
-            with open(local_filename, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    if chunk:  # Filter out keep-alive chunks
-                        f.write(chunk)
-        # Log or print the successful download
-        if logger:
-            logger.info(f"Downloaded: {local_filename}")
-        else:
-            print(f"Downloaded: {local_filename}")
-    except requests.RequestException as e:
-        # Log or print the error before retrying
-        if logger:
-            logger.error(f"Failed to download {url}: {e}")
-        else:
-            print(f"Failed to download {url}: {e}")
+        try:
+            # Stream the download to handle large files efficiently
+            with os.fdopen(fd, 'wb') as f, session.get(url, stream=True) as r:
+                r.raise_for_status()
+                # Let urllib3 undo any transfer encoding and copy in 1 MiB blocks
+                r.raw.decode_content = True
+                # Reserve the full size up front so the filesystem can allocate
+                # the file in one go; Content-Length only matches the bytes
+                # written when the body is not content-encoded
+                content_length = r.headers.get('Content-Length', '')
+                if (content_length.isdigit() and int(content_length) > 0
+                        and 'Content-Encoding' not in r.headers
+                        and hasattr(os, 'posix_fallocate')):
+                    try:
+                        os.posix_fallocate(f.fileno(), 0, int(content_length))
+                    except OSError:
+                        pass  # Not supported here; the file just grows as written
+                shutil.copyfileobj(r.raw, f, length=1024 * 1024)
+                # Never keep reserved space past the bytes actually received
+                f.truncate()
+            os.replace(part_filename, local_filename)
+        except BaseException:
+            # Don't leave a partial file behind
+            try:
+                os.remove(part_filename)
+            except OSError:
+                pass
+            raise
+        # Log the successful download
+        logger.info(f"Downloaded: {local_filename}")
+    except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+        # Log the error before re-raising; urllib3 errors come from reading
+        # r.raw directly, which requests does not wrap
+        logger.error(f"Failed to download {url}: {e}")
         raise
     except Exception as e:
         # Catch all other exceptions (e.g., OSError from open)
-        if logger:
-            logger.error(f"Error downloading {url}: {e}")
-        else:
-            print(f"Error downloading {url}: {e}")
-        raise  # Trigger retry
+        logger.error(f"Error downloading {url}: {e}")
+        raise
 
 def setup_logging():
     """
     Sets up logging to a file 'image_downloader.log'.
 
+    The queue handler is attached to the root logger, so records from
+    libraries (e.g. urllib3's retry warnings) also end up in the file instead
+    of on the console. Records are handed to a queue and written by a single
+    listener thread, so download workers never block on file I/O while logging.
+
     Returns:
-        logging.Logger: Configured logger object.
+        tuple: The configured logging.Logger and the started
+            logging.handlers.QueueListener, which must be stopped to flush
+            remaining records.
     """
-    logging.basicConfig(
-        filename='image_downloader.log',
-        filemode='a',
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        level=logging.INFO
-    )
-    return logging.getLogger('ImageDownloader')
+    log_queue = queue.Queue(-1)
+    file_handler = logging.FileHandler('image_downloader.log', mode='a')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    listener = QueueListener(log_queue, file_handler)
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(QueueHandler(log_queue))
+    listener.start()
+    return logging.getLogger('ImageDownloader'), listener
 
 def main():
     """
@@ -240,12 +385,15 @@ def main():
     raw_image = args.raw_image
     no_watermark = args.no_watermark
     enable_parallel = args.parallel
+    jobs = args.jobs
     enable_logging = args.log
 
     # Setup logging if enabled
     logger = None
     if enable_logging:
-        logger = setup_logging()
+        logger, log_listener = setup_logging()
+        # Flush queued records on every exit path, including sys.exit()
+        atexit.register(log_listener.stop)
         logger.info(f"Starting download for order ID: {order_id}")
 
     # Construct the full page URL
@@ -264,6 +412,9 @@ def main():
                       "AppleWebKit/537.36 (KHTML, like Gecko) "
                       "Chrome/117.0.0.0 Safari/537.36"
     }
+    # One extra connection for the photos page, which stays open while it
+    # streams and downloads are already running
+    session = create_session(headers, pool_maxsize=jobs + 1)
 
     # Print Disclaimer
     print("\n⚠️  Disclaimer:")
@@ -273,66 +424,113 @@ def main():
     if enable_logging:
         logger.info("Printed disclaimer to console.")
 
-    print(f"Fetching HTML content from: {page_url}")
-    if enable_logging:
-        logger.info(f"Fetching HTML content from: {page_url}")
-    html_content = get_html_content(page_url, headers)
-    if not html_content:
-        print("No HTML content to process.")
-        if enable_logging:
-            logger.warning("No HTML content fetched.")
-        sys.exit(1)
-
-    if enable_logging:
-        logger.info("HTML content fetched successfully.")
-
-    print("Extracting image URLs...")
-    if enable_logging:
-        logger.info("Extracting image URLs.")
+    # Normalize extensions to lowercase for case-insensitive matching; a tuple
+    # lets str.endswith test all of them in one call
+    ext_tuple = tuple(ext.lower() for ext in extensions)
 
-    # Prepare parameters to remove based on flags
-    remove_params = {}
+    # Collect every query parameter name that should be dropped from the URLs
+    remove_set = set(user_remove_params or [])
     if raw_image:
-        remove_params['raw_image'] = True
+        remove_set.update(('width', 'height'))
     if no_watermark:
-        remove_params['no_watermark'] = True
-    if user_remove_params:
-        remove_params['additional_params'] = user_remove_params
-    else:
-        remove_params['additional_params'] = []
-
-    # Extract image URLs with the specified criteria
-    image_urls = extract_image_urls(html_content, base_url, extensions, remove_params)
-    print(f"Found {len(image_urls)} unique image URL{'s' if len(image_urls) !=1 else ''}.")
+        remove_set.add('watermark')
+    remove_set = frozenset(remove_set)
+
+    # Images already on disk are skipped before they are handed to a worker;
+    # one directory listing replaces a stat() per URL
+    existing_files = set()
+    stale_part_files = set()
+    stale_before = time.time() - _STALE_PART_AGE
+    for entry in os.scandir(output_dir):
+        existing_files.add(entry.name)
+        # A recently modified '.part' file may still be written by another run
+        if (entry.name.endswith('.part') and entry.is_file()
+                and entry.stat().st_mtime < stale_before):
+            stale_part_files.add(entry.name)
+
+    print(f"Fetching image URLs from: {page_url}")
     if enable_logging:
-        logger.info(f"Found {len(image_urls)} image URLs.")
-
-    if not image_urls:
-        print("No images found. Please ensure that the page is accessible and contains image links.")
-        if enable_logging:
-            logger.warning("No images found to download.")
-        sys.exit(1)
-
-    print("Starting image downloads...")
+        logger.info(f"Fetching image URLs from: {page_url}")
 
     if enable_parallel:
         # Enable parallel downloads using ThreadPoolExecutor
         print("Downloading images in parallel using multithreading...")
         if enable_logging:
             logger.info("Starting parallel downloads.")
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            # Submit download tasks for each image URL
-            futures = [
-                executor.submit(download_image, url, output_dir, headers, logger)
-                for url in image_urls
-            ]
+        # Downloads are network-bound: workers spend nearly all their time
+        # blocked on sockets (GIL released), so many can overlap
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+    else:
+        executor = None
+
+    # Parse the page while it streams in; in parallel mode each download starts
+    # as soon as its link has been parsed
+    found = 0
+    pending_urls = []
+    futures = []
+    try:
+        try:
+            for url in iter_image_urls(session, page_url, base_url, ext_tuple, remove_set):
+                found += 1
+                filename = os.path.basename(urlparse(url).path)
+                if filename in existing_files:
+                    continue
+                # Keep the first image for each file name; later ones would overwrite it
+                existing_files.add(filename)
+                if filename + '.part' in stale_part_files:
+                    # Leftover from an interrupted download of this image; fetch it again
+                    try:
+                        os.remove(os.path.join(output_dir, filename + '.part'))
+                    except FileNotFoundError:
+                        pass
+                if executor:
+                    futures.append(executor.submit(download_image, url, output_dir, session, logger))
+                else:
+                    pending_urls.append(url)
+        except requests.RequestException as e:
+            # The image list is incomplete; don't report a partial run as a success
+            print(f"Error fetching HTML from URL: {e}")
+            if enable_logging:
+                logger.error(f"Error fetching HTML from URL: {e}")
+            for future in futures:
+                future.cancel()
+            sys.exit(1)
+
+        print(f"Found {found} unique image URL{'s' if found != 1 else ''}.")
+        if enable_logging:
+            logger.info(f"Found {found} image URLs.")
+
+        if not found:
+            print("No images found. Please ensure that the page is accessible and contains image links.")
+            if enable_logging:
+                logger.warning("No images found to download.")
+            sys.exit(1)
+
+        skipped = found - len(futures) - len(pending_urls)
+        if skipped:
+            print(f"Skipping {skipped} image{'s' if skipped != 1 else ''} already in {output_dir} "
+                  f"or sharing a file name with another image.")
+            if enable_logging:
+                logger.info(f"Skipping {skipped} already downloaded or duplicate-named images.")
+
+        if skipped == found:
+            print("All images have already been downloaded.")
+            if enable_logging:
+                logger.info("All images have already been downloaded.")
+            return
+
+        if executor:
             # Display a progress bar while downloads are in progress
             for _ in tqdm(concurrent.futures.as_completed(futures), total=len(futures), desc="Downloading"):
                 pass
-    else:
-        # Sequential downloads with a progress bar
-        for url in tqdm(image_urls, desc="Downloading images"):
-            download_image(url, output_dir, headers, logger)
+        else:
+            # Sequential downloads with a progress bar
+            print("Starting image downloads...")
+            for url in tqdm(pending_urls, desc="Downloading images"):
+                download_image(url, output_dir, session, logger)
+    finally:
+        if executor:
+            executor.shutdown()
 
     print("All downloads completed.")
     if enable_logging: